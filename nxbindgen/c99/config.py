@@ -1,4 +1,7 @@
-INCLUDES = [
+from types import MappingProxyType
+
+# Both tables are read-only, keep them immutable
+INCLUDES = (
     'Python.h',
     'pycore_abstract.h',      # _PyIndex_Check()
     'pycore_call.h',          # _PyObject_FastCallDictTstate()
@@ -26,9 +29,9 @@ INCLUDES = [
     'pydtrace.h',
     'setobject.h',
     'structmember.h',         # struct PyMemberDef, T_OFFSET_EX
-]
+)
 
-DEFINES = {
+DEFINES = MappingProxyType({
     # Stack effect macros
     'SET_TOP(v)': '(env.stack.set_top(v))',
     'SET_SECOND(v)': '(env.stack.set_second(v))',
@@ -78,9 +81,7 @@ DEFINES = {
     '_Py_DECREF_NO_DEALLOC(val)': '(env.memory.dec_ref_no_dealloc(val))',
     # Special
     'TARGET(name)': 'void op_##name(env)',
-    'def': '_def',  # TODO: this is a bad idea
-    'from': '_from',
     'NULL': 'None',
     '_Py_TrueStruct': 'True',
     '_Py_FalseStruct': 'False',
-}
+})
@@ -6,10 +6,11 @@
 #   Modifications released under GPLv2 License
 
 import re
+import keyword
+import functools
 import contextlib
 
-from enum import IntFlag, auto
-from typing import Optional, Callable, Tuple
+from typing import Iterator, Optional, Tuple
 
 from pycparser import c_ast
 
@@ -18,10 +19,58 @@ __all__ = [
 ]
 
 
-class Context(IntFlag):
-    FuncProto = auto()
-    FuncBody = auto()
-    FuncArgs = auto()
+# None/True/False are produced on purpose (NULL, _Py_TrueStruct, _Py_FalseStruct)
+PY_KEYWORDS = frozenset(keyword.kwlist) - {'None', 'True', 'False'}
+
+
+def safe_name(name: str) -> str:
+    """ C identifiers may clash with Python keywords (from, def, ...), suffix them like PEP 8 suggests. """
+    return name + '_' if name in PY_KEYWORDS else name
+
+
+RE_LITERAL_SUFFIX = re.compile(r'^([0-9a-f.x]+)(ull|ll|ul|l|uz|u|z)$', re.IGNORECASE)
+RE_BLANK_LINE = re.compile(r'^[^\S\n]*(?:\n|$)', re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=4096)
+def convert_literal(value: str) -> str:
+    """ Strips C suffixes from numeric literals, the same literals repeat a lot, so it's cached. """
+    # TODO: Check literal strings
+    # Suffixes are letters only, skip the regex for everything else (plain ints, floats, chars, strings)
+    if not value[-1].isalpha():
+        return value
+    stripped = RE_LITERAL_SUFFIX.sub(r'\1', value)
+    if '.' in stripped and stripped[-1] == 'f':
+        stripped = stripped[:-1]
+    return stripped
+
+
+# Nodes that always bind stronger than operators, Cast and &/* unary ops are reduced in Python
+SIMPLE_NODE_TYPES = frozenset({
+    c_ast.Constant, c_ast.ID, c_ast.ArrayRef, c_ast.StructRef, c_ast.FuncCall, c_ast.Cast,
+})
+# Nodes rendered as a single expression, they don't need extra parentheses as a condition
+SINGLE_NODE_TYPES = frozenset({
+    c_ast.BinaryOp, c_ast.UnaryOp, c_ast.FuncCall, c_ast.Constant, c_ast.ID, c_ast.Cast, c_ast.StructRef,
+})
+# Top-level nodes rendered as a single block, and nodes (or declaration types) ignored for now
+TOP_LEVEL_BLOCK_TYPES = frozenset({c_ast.FuncDef, c_ast.Pragma})
+TOP_LEVEL_SKIP_TYPES = frozenset({c_ast.Typedef, c_ast.Struct})
+TOP_LEVEL_SKIP_DECL_TYPES = frozenset({c_ast.FuncDecl, c_ast.Struct})
+# Statements that can also appear in an expression context, rendered as a single line
+EXPR_STMT_TYPES = frozenset({
+    c_ast.Decl, c_ast.Assignment, c_ast.Cast, c_ast.UnaryOp,
+    c_ast.BinaryOp, c_ast.TernaryOp, c_ast.FuncCall, c_ast.ArrayRef,
+    c_ast.StructRef, c_ast.Constant, c_ast.ID, c_ast.Typedef,
+    c_ast.ExprList,
+})
+
+
+class Context:
+    # Plain int bits, IntFlag's Python-level __or__/__and__ is too slow for a per-node check
+    FuncProto = 1 << 0
+    FuncBody = 1 << 1
+    FuncArgs = 1 << 2
 
 
 # TODO: Better interface for string building (emit), blocks and so on
@@ -33,64 +82,89 @@ class PyGenerator:
     """
     DEFAULT_INDENT = ' ' * 4
 
+    __slots__ = (
+        '_state', '_parent', '_skip', '_indent_level', '_indent_cache', '_list_types',
+        '_use_type_hints', '_reduce_parentheses', '_keep_empty_decl', '_type_hint_decl',
+        '_debug', '_dispatch', '_type_dispatch',
+    )
+
     def __init__(
         self, *,
         reduce_parentheses=True,
         use_type_hints=False,
         keep_empty_declarations=False,
         type_hint_declarations=False,
+        debug=False,
     ) -> None:
         # Statements start with indentation of self._indent_level spaces, using
         # the _make_indent method.
         self._state = 0
         self._parent = None
-        self._skip = set()
+        self._skip = {}
         self._indent_level = 0
+        self._indent_cache = ['']
+        self._list_types = {}
         self._use_type_hints = use_type_hints
         self._reduce_parentheses = reduce_parentheses
         self._keep_empty_decl = keep_empty_declarations
         self._type_hint_decl = type_hint_declarations
-
-    @contextlib.contextmanager
-    def indent(self, cond: Optional[bool | Callable] = None):
-        if cond is None:
-            cond = True
-        elif callable(cond):
-            cond = cond()
-        if cond:
-            self._indent_level += 1
-        yield
-        if cond:
-            self._indent_level -= 1
+        self._debug = debug
+        # Resolve visit_<NodeName> handlers once, keyed by the node class
+        self._dispatch = {
+            node_cls: getattr(self, name)
+            for name in dir(self)
+            if name.startswith('visit_') and isinstance(node_cls := getattr(c_ast, name[6:], None), type)
+        }
+        # Type nodes handled by _generate_type, anything else is visited as usual
+        self._type_dispatch = {
+            c_ast.TypeDecl: self._generate_type_decl,
+            c_ast.Decl: self._generate_decl_type,
+            c_ast.Typename: self._generate_typename_type,
+            c_ast.IdentifierType: self._generate_identifier_type,
+            c_ast.ArrayDecl: self._generate_modifier_type,
+            c_ast.PtrDecl: self._generate_modifier_type,
+            c_ast.FuncDecl: self._generate_modifier_type,
+        }
 
     @contextlib.contextmanager
     def skip(self, *names):
-        for name in names:
-            self._skip.add(name)
-        yield
-        for name in names:
-            self._skip.remove(name)
+        # Counted, so nested skips of the same node type don't cancel each other
+        node_types = [getattr(c_ast, name) for name in names]
+        for node_type in node_types:
+            self._skip[node_type] = self._skip.get(node_type, 0) + 1
+        try:
+            yield
+        finally:
+            for node_type in node_types:
+                if count := self._skip[node_type] - 1:
+                    self._skip[node_type] = count
+                else:
+                    del self._skip[node_type]
 
     def _make_indent(self, extra: int = 0):
-        return self.DEFAULT_INDENT * (self._indent_level + extra)
+        # Indent strings are reused per level instead of being multiplied on every statement
+        level = self._indent_level + extra
+        cache = self._indent_cache
+        if level < 0:
+            return ''
+        while len(cache) <= level:
+            cache.append(cache[-1] + self.DEFAULT_INDENT)
+        return cache[level]
 
     def visit(
         self, node, *,
         parent: Optional[c_ast.Node],
-        flag: Optional[Context] = None,
+        flag: int = 0,
         **kwargs
     ):
-        cls_name = node.__class__.__name__
-        if cls_name in self._skip:
+        node_type = type(node)
+        if node_type in self._skip:
             return ''
-        method = f'visit_{cls_name}'
-        if flag:
-            self._state |= flag
-        prev_parent, self._parent = self._parent, parent
-        ret = getattr(self, method, self.generic_visit)(node, **kwargs)
-        self._parent = prev_parent
-        if flag:
-            self._state &= ~flag
+        prev_state, prev_parent = self._state, self._parent
+        self._state |= flag
+        self._parent = parent
+        ret = self._dispatch.get(node_type, self.generic_visit)(node, **kwargs)
+        self._state, self._parent = prev_state, prev_parent
         return ret
 
     def generic_visit(self, node):
@@ -99,20 +173,11 @@ class PyGenerator:
         else:
             return ''.join(self.visit(c, parent=node) for c_name, c in node.children())
 
-    RE_LITERAL_SUFFIX = re.compile(r'^([0-9a-f.x]+)(ull|ll|ul|l|uz|u|z)$', re.IGNORECASE)
-
-    def _convert_literal(self, value: str) -> str:
-        # TODO: Check literal strings
-        stripped = self.RE_LITERAL_SUFFIX.sub(r'\1', value)
-        if '.' in stripped and stripped[-1] == 'f':
-            stripped = stripped[:-1]
-        return stripped
-
     def visit_Constant(self, n):
-        return self._convert_literal(n.value)
+        return convert_literal(n.value)
 
     def visit_ID(self, n):
-        return n.name
+        return safe_name(n.name)
 
     def visit_Pragma(self, n):
         ret = '#pragma'
@@ -121,11 +186,19 @@ class PyGenerator:
         return ret
 
     def visit_ArrayRef(self, n):
-        arrref = self._parenthesize_unless_simple(n.name, parent=n)
+        # Plain identifiers are the usual case, they never need parentheses
+        if type(n.name) is c_ast.ID:
+            arrref = safe_name(n.name.name)
+        else:
+            arrref = self._parenthesize_unless_simple(n.name, parent=n)
         return arrref + '[' + self.visit(n.subscript, parent=n) + ']'
 
     def visit_StructRef(self, n):
-        sref = self._parenthesize_unless_simple(n.name, parent=n)
+        # Plain identifiers are the usual case, they never need parentheses
+        if type(n.name) is c_ast.ID:
+            sref = safe_name(n.name.name)
+        else:
+            sref = self._parenthesize_unless_simple(n.name, parent=n)
         ref_type = n.type
         # TODO: Check other types, we're good with '.' only
         if ref_type == '->':
@@ -133,7 +206,11 @@ class PyGenerator:
         return sref + ref_type + self.visit(n.field, parent=n)
 
     def visit_FuncCall(self, n):
-        fref = self._parenthesize_unless_simple(n.name, parent=n)
+        # Plain identifiers are the usual case, they never need parentheses
+        if type(n.name) is c_ast.ID:
+            fref = safe_name(n.name.name)
+        else:
+            fref = self._parenthesize_unless_simple(n.name, parent=n)
         return fref + '(' + self.visit(n.args, parent=n) + ')'
 
     unary_op_map = {
@@ -146,7 +223,7 @@ class PyGenerator:
         if n.op == 'sizeof':
             # Always parenthesize the argument of sizeof since it can be
             # a name.
-            return 'sizeof(%s)' % self.visit(n.expr, parent=n)
+            return f'sizeof({self.visit(n.expr, parent=n)})'
         else:
             operand = self._parenthesize_unless_simple(n.expr, parent=n)
             # TODO: We need to detect cases when we can't do this
@@ -157,7 +234,7 @@ class PyGenerator:
                 # return '%s--' % operand
                 return f'{operand} -= 1'
             else:
-                return '%s%s' % (self.unary_op_map.get(n.op, n.op), operand)
+                return f'{self.unary_op_map.get(n.op, n.op)}{operand}'
 
     # Precedence map of binary operators:
     precedence_map = {
@@ -190,15 +267,16 @@ class PyGenerator:
         # If the left operator is weaker binding than the current, then
         # parentheses are necessary:
         # e.g., `(a+b) * c` is NOT equivalent to `a+b * c`.
-        lval_str = self._parenthesize_if(
-            n.left,
-            parent=n,
-            condition=lambda d: not (
-                self._is_simple_node(d) or
-                self._reduce_parentheses and isinstance(d, c_ast.BinaryOp) and
-                self.precedence_map[d.op] >= self.precedence_map[n.op]
-            )
-        )
+        # Conditions are inlined, no closures per node
+        precedence_map, reduce_parentheses = self.precedence_map, self._reduce_parentheses
+        op_precedence = precedence_map[n.op]
+        left, right = n.left, n.right
+        lval_str = self._visit_expr(left, parent=n)
+        if not (
+            self._is_simple_node(left) or
+            reduce_parentheses and type(left) is c_ast.BinaryOp and precedence_map[left.op] >= op_precedence
+        ):
+            lval_str = f'({lval_str})'
         # If `n.right.op` has a stronger -but not equal- binding precedence,
         # parenthesis can be omitted on the right:
         # e.g., `a + (b*c)` is equivalent to `a + b*c`.
@@ -206,23 +284,20 @@ class PyGenerator:
         # are necessary:
         # e.g., `a * (b+c)` is NOT equivalent to `a * b+c` and
         #       `a - (b+c)` is NOT equivalent to `a - b+c` (same precedence).
-        rval_str = self._parenthesize_if(
-            n.right,
-            parent=n,
-            condition=lambda d: not (
-                self._is_simple_node(d) or
-                self._reduce_parentheses and isinstance(d, c_ast.BinaryOp) and
-                self.precedence_map[d.op] > self.precedence_map[n.op]
-            )
-        )
-        return '%s %s %s' % (lval_str, self.binary_op_map.get(n.op, n.op), rval_str)
+        rval_str = self._visit_expr(right, parent=n)
+        if not (
+            self._is_simple_node(right) or
+            reduce_parentheses and type(right) is c_ast.BinaryOp and precedence_map[right.op] > op_precedence
+        ):
+            rval_str = f'({rval_str})'
+        return f'{lval_str} {self.binary_op_map.get(n.op, n.op)} {rval_str}'
 
     def visit_Assignment(self, n):
         lval_str = self.visit(n.lvalue, parent=n)
         # TODO: Python is ok w/ chained assignment and not ok w/ x = (y = z)
         # rval_str = self._parenthesize_if(n.rvalue, lambda x: isinstance(x, c_ast.Assignment))
         rval_str = self.visit(n.rvalue, parent=n)
-        return '%s %s %s' % (lval_str, n.op, rval_str)
+        return f'{lval_str} {n.op} {rval_str}'
 
     def visit_IdentifierType(self, n):
         return ' '.join(n.names)
@@ -239,21 +314,22 @@ class PyGenerator:
     def visit_Decl(self, n, no_type=False):
         # no_type is used when a Decl is part of a DeclList, where the type is
         # explicitly only for the first declaration in a list.
-        s = n.name if no_type else self._generate_decl(n)
+        init = n.init
+        # We should ignore those outside of the func body, don't even render them
+        empty_in_body = not init and self._state & Context.FuncBody
+        if empty_in_body and not self._keep_empty_decl:
+            return ''
+        s = safe_name(n.name) if no_type else self._generate_decl(n)
         if n.bitsize:
             s += ' : ' + self.visit(n.bitsize, parent=n)
-        if n.init:
+        if init:
             # TODO: We have lhs' type, hypothetically we can convert 0 to False, for example, and so on
-            s += ' = ' + self._visit_expr(n.init, parent=n)
-        # We should ignore those outside of the func body
-        if not n.init and self._state & Context.FuncBody:
-            if self._keep_empty_decl:
-                if self._type_hint_decl:
-                    s += ' | None = None'
-                else:
-                    s += ' = None'
+            s += ' = ' + self._visit_expr(init, parent=n)
+        elif empty_in_body:
+            if self._type_hint_decl:
+                s += ' | None = None'
             else:
-                s = ''
+                s += ' = None'
         return s
 
     def visit_DeclList(self, n):
@@ -299,21 +375,14 @@ class PyGenerator:
         return self._generate_struct_union_enum(n, name='enum')
 
     def visit_Alignas(self, n):
-        return '_Alignas({})'.format(self.visit(n.alignment, parent=n))
+        return f'_Alignas({self.visit(n.alignment, parent=n)})'
 
     def visit_Enumerator(self, n):
         if not n.value:
             # TODO: Import auto
-            return '{indent}{name} = auto()\n'.format(
-                indent=self._make_indent(),
-                name=n.name,
-            )
+            return f'{self._make_indent()}{safe_name(n.name)} = auto()\n'
         else:
-            return '{indent}{name} = {value}\n'.format(
-                indent=self._make_indent(),
-                name=n.name,
-                value=self.visit(n.value, parent=n),
-            )
+            return f'{self._make_indent()}{safe_name(n.name)} = {self.visit(n.value, parent=n)}\n'
 
     def visit_FuncDef(self, n):
         decl = self.visit(n.decl, parent=n, flag=Context.FuncProto)
@@ -321,8 +390,7 @@ class PyGenerator:
         body = self.visit(n.body, parent=n, flag=Context.FuncBody)
         # We can't have an empty body in the function definition, TODO: check similar cases
         if not body:
-            with self.indent():
-                body = self._make_indent() + 'pass'
+            body = self._make_indent(1) + 'pass'
         if n.param_decls:
             knrdecls = ';\n'.join(self.visit(p, parent=n) for p in n.param_decls)
             return 'def ' + decl + ':\n' + knrdecls + ';\n' + body + '\n'
@@ -330,25 +398,28 @@ class PyGenerator:
             return 'def ' + decl + ':\n' + body + '\n'
 
     def visit_FileAST(self, n):
-        s = ''
+        return ''.join(self.iter_file_ast(n))
+
+    def iter_file_ast(self, n: c_ast.FileAST) -> Iterator[str]:
+        """ Yields the rendered top-level declarations one by one, each chunk ends
+        with a newline, so callers can write them out without keeping the whole
+        module in memory. """
         for ext in n.ext:
-            if isinstance(ext, c_ast.FuncDef):
-                s += self.visit(ext, parent=n) + '\n'
-            elif isinstance(ext, c_ast.Pragma):
-                s += self.visit(ext, parent=n) + '\n'
+            ext_type = type(ext)
+            if ext_type in TOP_LEVEL_BLOCK_TYPES:
+                yield self.visit(ext, parent=n) + '\n'
             # TODO: Add some class-level filter, too hardcoded now
-            elif isinstance(ext, (c_ast.Typedef, c_ast.Struct)):
+            elif ext_type in TOP_LEVEL_SKIP_TYPES:
                 # Let's ignore for now
                 # print('ignoring:', ext.name)
                 pass
             else:
-                if isinstance(ext.type, (c_ast.FuncDecl, c_ast.Struct)):
+                if type(ext.type) in TOP_LEVEL_SKIP_DECL_TYPES:
                     # Typedef, Struct, TypeDecl, FuncDecl
                     # print('ignoring:', ext.name)
                     pass
                 else:
-                    s += self.visit(ext, parent=n) + '\n\n\n'  # ';\n'
-        return s
+                    yield self.visit(ext, parent=n) + '\n\n\n'  # ';\n'
 
     def visit_Compound(self, n):
         # TODO: Find a proper solution for compound inside of compound
@@ -356,10 +427,10 @@ class PyGenerator:
         if do_indent := not isinstance(self._parent, c_ast.Compound):
             self._indent_level += 1
         if n.block_items:
-            s += ''.join(self._generate_stmt(stmt, parent=n) for stmt in n.block_items)
+            s = ''.join([self._generate_stmt(stmt, parent=n) for stmt in n.block_items])
         if do_indent:
             self._indent_level -= 1
-        s += ''  # self._make_indent() + '}\n'
+        # s += self._make_indent() + '}\n'
         return s
 
     def visit_CompoundLiteral(self, n):
@@ -420,55 +491,58 @@ class PyGenerator:
                 return ''
 
         # Regular if processing
-        s = 'if '
         if n.cond:
             cond_str = self.visit(n.cond, parent=n)
             if not self._is_single_node(n.cond):
                 cond_str = f'({cond_str})'
         else:
             cond_str = '()'
-        s += cond_str + ':\n'
-        s += self._generate_stmt(n.iftrue, parent=n, add_indent=True)
+        parts = ['if ', cond_str, ':\n', self._generate_stmt(n.iftrue, parent=n, add_indent=True)]
         # TODO: There's a problem w/ indents in nested ifs, original c/py mix
         if n.iffalse:
             # Special case for elif instead else if
             if isinstance(n.iffalse, c_ast.If):
-                s += self._make_indent() + 'el' + self._generate_stmt(n.iffalse, parent=n, add_indent=True).lstrip()
+                parts += (self._make_indent(), 'el', self._generate_stmt(n.iffalse, parent=n, add_indent=True).lstrip())
             else:
-                s += self._make_indent() + 'else:\n'
-                s += self._generate_stmt(n.iffalse, parent=n, add_indent=True)
-        return s
+                parts += (self._make_indent(), 'else:\n', self._generate_stmt(n.iffalse, parent=n, add_indent=True))
+        return ''.join(parts)
 
     def _for_to_range(self, n: c_ast.For) -> Optional[str]:
         # To convert for-loop to range we need to make sure that
-        #  - isinstance(n.next, c_ast.UnaryOp)
-        #  - isinstance(n.init, c_ast.Assignment)
-        #  - isinstance(n.cond, c_ast.BinaryOp)
-        #  - n.next.expr == n.init.lvalue == n.cond.left
-        init_decl = False
-        if (
-            (
-                isinstance(n.init, c_ast.Assignment) or
-                (init_decl := (isinstance(n.init, c_ast.DeclList) and (len(n.init.decls) == 1)))
-            ) and  # isinstance(n.init.rvalue, c_ast.Constant) and
-            isinstance(n.next, c_ast.UnaryOp) and n.next.op in ('p++', '++p', 'p--', '--p', '++', '--') and
-            isinstance(n.cond, c_ast.BinaryOp) and  # isinstance(n.cond.right, c_ast.Constant) and
-            (var_name := n.next.expr.name) == (n.init.decls[0].name if init_decl else n.init.lvalue.name) == n.cond.left.name
-        ):
-            # TODO: Better direction checks, step control and so on
-            if init_decl:
-                init_str = self.visit(n.init.decls[0].init, parent=n.init)  # TODO: or parent=n.init.decls[0]?
+        #  - n.next is ++/-- over a variable (ID)
+        #  - n.init is an assignment or a single declaration of the same variable
+        #  - n.cond is a binary op with the same variable on the left
+        # Cheapest rejections go first, every attribute is read once
+        init, cond, step_op = n.init, n.cond, n.next
+        if type(step_op) is not c_ast.UnaryOp or step_op.op not in ('p++', '++p', 'p--', '--p', '++', '--'):
+            return None
+        if type(cond) is not c_ast.BinaryOp or type(cond.left) is not c_ast.ID:
+            return None
+        if type(step_op.expr) is not c_ast.ID:
+            return None
+        var_name = step_op.expr.name
+        init_type = type(init)
+        if init_type is c_ast.Assignment:  # and isinstance(init.rvalue, c_ast.Constant)
+            if type(init.lvalue) is not c_ast.ID:
+                return None
+            init_name, init_expr = init.lvalue.name, init.rvalue
+        elif init_type is c_ast.DeclList and len(init.decls) == 1:
+            init_name, init_expr = init.decls[0].name, init.decls[0].init  # TODO: or parent=init.decls[0]?
+        else:
+            return None
+        if not (var_name == init_name == cond.left.name):
+            return None
+        # TODO: Better direction checks, step control and so on
+        init_str = self.visit(init_expr, parent=init)
+        cond_right = cond.right  # isinstance(cond.right, c_ast.Constant)
+        cond_str = self.visit(cond_right, parent=cond)
+        step = -1 if '--' in step_op.op else +1
+        if cond.op in ('>=', '<='):
+            if type(cond_right) is c_ast.Constant:
+                cond_str = f'{int(cond_str) + step}'
             else:
-                init_str = self.visit(n.init.rvalue, parent=n.init)
-            cond_str = self.visit(n.cond.right, parent=n.cond)
-            step = -1 if '--' in n.next.op else +1
-            if n.cond.op in ('>=', '<='):
-                if isinstance(n.cond.right, c_ast.Constant):
-                    cond_str = f'{int(cond_str) + step}'
-                else:
-                    cond_str = f'{cond_str} {"-" if step < 0 else "+"} 1'
-            return f'for {var_name} in range({init_str}, {cond_str}):'
-        return None
+                cond_str = f'{cond_str} {"-" if step < 0 else "+"} 1'
+        return f'for {safe_name(var_name)} in range({init_str}, {cond_str}):'
 
     def visit_For(self, n):
         # TODO: In Python we will have a few different ways to render C-for
@@ -483,27 +557,26 @@ class PyGenerator:
         #     s += ' ' + self.visit(n.next, parent=n)
         # s += ')\n'
         # s += self._generate_stmt(n.stmt, add_indent=True)
-        s = ''
+        parts = []
         if range_str := self._for_to_range(n):
-            s += f'{range_str}\n'
-            s += self._generate_stmt(n.stmt, parent=n, add_indent=True)[:-1]  # TODO: Drops \n, otherwise we have x2
+            parts.append(f'{range_str}\n')
+            parts.append(self._generate_stmt(n.stmt, parent=n, add_indent=True)[:-1])  # TODO: Drops \n, otherwise we have x2
         else:
             # Default fallback to while-loop
             if n.init:
-                s += self.visit(n.init, parent=n) + '\n'
+                parts.append(self.visit(n.init, parent=n) + '\n')
             indent = self._indent_level
-            s += self._make_indent() + 'while True:\n'
-            s += self._generate_stmt(n.stmt, parent=n, add_indent=True)
+            parts.append(self._make_indent() + 'while True:\n')
+            parts.append(self._generate_stmt(n.stmt, parent=n, add_indent=True))
             # TODO: Awful indent level calculation here, refactor asap
             self._indent_level += 1
             if n.next:
-                s += self._make_indent() + self.visit(n.next, parent=n) + '\n'
+                parts.append(self._make_indent() + self.visit(n.next, parent=n) + '\n')
             if n.cond:
-                s += self._make_indent() + f'if not ({self.visit(n.cond, parent=n)}):\n'
-                with self.indent():
-                    s += self._make_indent() + 'break'
+                parts.append(self._make_indent() + f'if not ({self.visit(n.cond, parent=n)}):\n')
+                parts.append(self._make_indent(1) + 'break')
             self._indent_level = indent
-        return s
+        return ''.join(parts)
 
     def _extract_effects(
         self, n: c_ast.Node
@@ -519,11 +592,12 @@ class PyGenerator:
         if isinstance(n, c_ast.BinaryOp):
             (l_pre, l_post, l_expr) = self._extract_effects(n.left)
             (r_pre, r_post, r_expr) = self._extract_effects(n.right)
-            pre = list(filter(None, [l_pre, r_pre])) or [None]
-            post = list(filter(None, [l_post, r_post])) or [None]
+            # Effect-free operands are the common case, don't build wrappers for them
+            if l_pre is None and r_pre is None and l_post is None and r_post is None:
+                return None, None, n if l_expr is n.left and r_expr is n.right else c_ast.BinaryOp(n.op, l_expr, r_expr)
             return (
-                c_ast.Compound(block_items=pre) if len(pre) > 1 else pre[0],
-                c_ast.Compound(block_items=post) if len(post) > 1 else post[0],
+                r_pre if l_pre is None else (l_pre if r_pre is None else c_ast.Compound(block_items=[l_pre, r_pre])),
+                r_post if l_post is None else (l_post if r_post is None else c_ast.Compound(block_items=[l_post, r_post])),
                 c_ast.BinaryOp(n.op, l_expr, r_expr)
             )
         if self._is_simple_node(n):
@@ -531,41 +605,40 @@ class PyGenerator:
         raise NotImplementedError
 
     def visit_While(self, n):
-        s = ''
+        parts = []
         pre, post, cond = self._extract_effects(n.cond)
         if pre:
-            print('pre-effect:', ' '.join(map(lambda x: x.strip(), str(pre).splitlines())))
-            s += self.visit(pre, parent=n) + '\n' + self._make_indent()
-        s += 'while '
+            if self._debug:
+                print('pre-effect:', ' '.join(map(lambda x: x.strip(), str(pre).splitlines())))
+            parts += (self.visit(pre, parent=n), '\n', self._make_indent())
         if cond:
             cond_str = self.visit(cond, parent=n)
             if not self._is_single_node(cond):
                 cond_str = f'({cond_str})'
         else:
             cond_str = '()'
-        s += cond_str + ':\n'
-        s += self._generate_stmt(n.stmt, parent=n, add_indent=True)
+        parts += ('while ', cond_str, ':\n', self._generate_stmt(n.stmt, parent=n, add_indent=True))
         if post:
-            print('post-effect:', ' '.join(map(lambda x: x.strip(), str(post).splitlines())))
-            s += self._make_indent(1) + self.visit(post, parent=n)
-        return s
+            if self._debug:
+                print('post-effect:', ' '.join(map(lambda x: x.strip(), str(post).splitlines())))
+            parts += (self._make_indent(1), self.visit(post, parent=n))
+        return ''.join(parts)
 
     def visit_DoWhile(self, n):
         # TODO: Verify
         indent = self._indent_level
-        s = 'while True:\n'  # 'do\n'
-        s += self._generate_stmt(n.stmt, parent=n, add_indent=True)
+        parts = ['while True:\n', self._generate_stmt(n.stmt, parent=n, add_indent=True)]  # 'do\n'
         # s += self._make_indent() + 'while ('
         # if n.cond:
         #     s += self.visit(n.cond, parent=n)
         # s += ');'
         if n.cond:
             self._indent_level = indent + 1
-            s += self._make_indent() + 'if not (' + self.visit(n.cond, parent=n) + '):\n'
+            parts += (self._make_indent(), 'if not (', self.visit(n.cond, parent=n), '):\n')
             self._indent_level += 1
-            s += self._make_indent() + 'break\n'
+            parts += (self._make_indent(), 'break\n')
         self._indent_level = indent
-        return s
+        return ''.join(parts)
 
     def visit_StaticAssert(self, n):
         s = '_Static_assert('
@@ -597,41 +670,47 @@ class PyGenerator:
 
     @staticmethod
     def _nstrip(value: str) -> str:
-        return '\n'.join(filter(None, map(lambda x: '' if not x.strip() else x, value.split('\n'))))
+        # Drops whitespace-only lines, the last line never ends with a newline
+        return RE_BLANK_LINE.sub('', value).rstrip('\n')
 
     def _switch_to_ifs(self, n: c_ast.Switch) -> str:
         # TODO: Check for conditional breaks also
-        s, idx, shared, blocks = '', 0, [], []
+        parts, shared, rendered, blocks = [], [], [], []
+        # Fallthrough cases share the statements tail, every statement is rendered only once
+        body = c_ast.Compound(block_items=shared)
         # We need a temp variable if it's not a constant
         if not isinstance(n.cond, (c_ast.ID, c_ast.Constant)):
             # TODO: init = c_ast.Assignment('=', c_ast...)?
             raise NotImplementedError
         for stmt in n.stmt:
             if isinstance(stmt, c_ast.Case):
-                blocks.append((c_ast.BinaryOp('==', n.cond, stmt.expr), idx))
+                blocks.append((c_ast.BinaryOp('==', n.cond, stmt.expr), len(shared)))
                 has_break = False
                 for sub in stmt.stmts:
                     if isinstance(sub, c_ast.Break):
                         has_break = True
-                        for idx, (cond, offset) in enumerate(blocks):
-                            if idx == 0:
-                                s += f'if {self.visit(cond, parent=stmt)}:\n'
+                        # Same indentation as the body of a Compound block
+                        self._indent_level += 1
+                        rendered += [self._generate_stmt(shared_stmt, parent=body) for shared_stmt in shared[len(rendered):]]
+                        self._indent_level -= 1
+                        for block_idx, (cond, offset) in enumerate(blocks):
+                            if block_idx == 0:
+                                parts.append(f'if {self.visit(cond, parent=stmt)}:\n')
                             else:
                                 # TODO: What's going on w/ indents? It's a mess, really
-                                s += self._make_indent() + f'elif {self.visit(cond, parent=stmt)}:\n'
-                            s += self.visit(c_ast.Compound(shared[offset:]), parent=n)
+                                parts.append(self._make_indent() + f'elif {self.visit(cond, parent=stmt)}:\n')
+                            parts.append(''.join(rendered[offset:]))
                         blocks.clear()
                     elif has_break:
                         raise NotImplementedError
                     else:
                         shared.append(sub)
-                        idx += 1
             elif isinstance(stmt, c_ast.Default):
                 with self.skip('Break'):
-                    s += self._make_indent() + 'else:\n' + self.visit(c_ast.Compound(stmt.stmts), parent=n)
+                    parts.append(self._make_indent() + 'else:\n' + self.visit(c_ast.Compound(stmt.stmts), parent=n))
             else:
                 raise NotImplementedError
-        return s
+        return ''.join(parts)
 
     def visit_Switch(self, n):
         # We can render python's match stmt only if not fallthrough
@@ -649,16 +728,14 @@ class PyGenerator:
 
     def visit_Case(self, n):
         # TODO: We need to check if the case is fallthrough (has no break), match doesn't support it
-        s = 'case ' + self.visit(n.expr, parent=n) + ':\n'
-        for stmt in n.stmts:
-            s += self._generate_stmt(stmt, parent=n, add_indent=True)
-        return s
+        parts = ['case ', self.visit(n.expr, parent=n), ':\n']
+        parts += (self._generate_stmt(stmt, parent=n, add_indent=True) for stmt in n.stmts)
+        return ''.join(parts)
 
     def visit_Default(self, n):
-        s = 'case _:\n'  # 'default:\n'
-        for stmt in n.stmts:
-            s += self._generate_stmt(stmt, parent=n, add_indent=True)
-        return s
+        parts = ['case _:\n']  # 'default:\n'
+        parts += (self._generate_stmt(stmt, parent=n, add_indent=True) for stmt in n.stmts)
+        return ''.join(parts)
 
     def visit_Label(self, n):
         # TODO: We don't support labels, so some handler/trigger should be activated here
@@ -684,7 +761,7 @@ class PyGenerator:
         s = ''
         for name in n.name:
             if isinstance(name, c_ast.ID):
-                s += '.' + name.name
+                s += '.' + safe_name(name.name)
             else:
                 s += '[' + self.visit(name, parent=n) + ']'
         s += ' = ' + self._visit_expr(n.expr, parent=n)
@@ -737,15 +814,9 @@ class PyGenerator:
         for individual visit_* methods to handle different treatment of
         some statements in this context. """
         typ = type(n)
-        with self.indent(add_indent):
-            indent = self._make_indent()
-
-        if typ in (
-            c_ast.Decl, c_ast.Assignment, c_ast.Cast, c_ast.UnaryOp,
-            c_ast.BinaryOp, c_ast.TernaryOp, c_ast.FuncCall, c_ast.ArrayRef,
-            c_ast.StructRef, c_ast.Constant, c_ast.ID, c_ast.Typedef,
-            c_ast.ExprList
-        ):
+        indent = self._make_indent(1 if add_indent else 0)
+
+        if typ in EXPR_STMT_TYPES:
             # These can also appear in an expression context so no semicolon
             # is added to them automatically
             if ret := self.visit(n, parent=parent):
@@ -753,12 +824,12 @@ class PyGenerator:
             else:
                 # It's possible that node will be reduced, TODO: check other cases like this
                 return ''
-        elif typ in (c_ast.Compound,):
+        elif typ is c_ast.Compound:
             # No extra indentation required before the opening brace of a
             # compound - because it consists of multiple lines it has to
             # compute its own indentation.
             return self.visit(n, parent=parent)
-        elif typ in (c_ast.If,):
+        elif typ is c_ast.If:
             return indent + self.visit(n, parent=parent)
         else:
             return indent + self.visit(n, parent=parent) + '\n'
@@ -796,74 +867,93 @@ class PyGenerator:
     def _map_type(self, c_type: str) -> str:
         return self.types_map.get(c_type, c_type)
 
+    def _list_type(self, c_type: str) -> str:
+        # Only a handful of distinct element types, so the wrapped names are reused
+        if (list_type := self._list_types.get(c_type)) is None:
+            list_type = self._list_types[c_type] = f'List[{self._map_type(c_type)}]'
+        return list_type
+
     def _generate_type(self, n, *, parent, modifiers=None, emit_declname=True):
         """ Recursive generation from a type node. n is the type node.
         modifiers collects the PtrDecl, ArrayDecl and FuncDecl modifiers
         encountered on the way down to a TypeDecl, to allow proper
         generation from it. """
-        typ = type(n)
-        modifiers = modifiers or []
-        if typ == c_ast.TypeDecl:
-            s = ''
-            if n.quals:
-                # TODO: Make some handle/trigger, we don't support quals in Python
-                # s += ' '.join(n.quals) + ' '
-                pass
+        if (generate := self._type_dispatch.get(type(n))) is None:
+            return self.visit(n, parent=parent)
+        if modifiers is None:
+            modifiers = []
+        return generate(n, parent=parent, modifiers=modifiers, emit_declname=emit_declname)
+
+    def _generate_type_decl(self, n, *, parent, modifiers, emit_declname):
+        nstr = safe_name(n.declname) if n.declname and emit_declname else ''
+        # Args are also a part of the prototype, so they're checked first
+        if self._state & Context.FuncArgs:
+            hint_sep = ': ' if self._use_type_hints else None
+        elif self._state & Context.FuncProto:
+            hint_sep = ' -> ' if self._use_type_hints else None
+        else:
+            hint_sep = ': ' if self._type_hint_decl else None
+        # Named declarations without a hint don't need the type at all
+        render_type = hint_sep is not None or not nstr
+
+        s = ''
+        if n.quals:
+            # TODO: Make some handle/trigger, we don't support quals in Python
+            # s += ' '.join(n.quals) + ' '
+            pass
+        if render_type:
             s += self.visit(n.type, parent=n)
 
-            nstr = n.declname if n.declname and emit_declname else ''
-            # Resolve modifiers.
-            # Wrap in parens to distinguish pointer to array and pointer to
-            # function syntax.
-            for i, modifier in enumerate(modifiers):
-                if isinstance(modifier, c_ast.ArrayDecl):
-                    # We don't need to wrap stuff at all, TODO: Revisit
-                    # if i != 0 and isinstance(modifiers[i - 1], c_ast.PtrDecl):
-                    #     nstr = '(' + nstr + ')'
-                    # TODO: Remove, check dim processing
-                    # nstr += '['
-                    # if modifier.dim_quals:
-                    #     nstr += ' '.join(modifier.dim_quals) + ' '
-                    # nstr += self.visit(modifier.dim, parent=n) + ']'
-                    s = f'List[{self._map_type(s)}]'
-                elif isinstance(modifier, c_ast.FuncDecl):
-                    # We don't need to wrap stuff at all, TODO: Revisit
-                    # if i != 0 and isinstance(modifiers[i - 1], c_ast.PtrDecl):
-                    #     nstr = '(' + nstr + ')'
-                    nstr += '(' + self.visit(modifier.args, parent=parent, flag=Context.FuncArgs) + ')'
-                elif isinstance(modifier, c_ast.PtrDecl):
-                    # TODO: We don't support quals (like 'const'), skipped
-                    # if modifier.quals:
-                    #     nstr = '* %s%s' % (' '.join(modifier.quals), ' ' + nstr if nstr else '')
-                    # else:
-                    #     nstr = '*' + nstr
-                    # There's no real way to determine what's this ptr means, so we can guess
-                    s = f'List[{self._map_type(s)}]'
-            if nstr:
-                s = self._map_type(s)
-                if isinstance(self._parent, c_ast.ParamList):  # self._state & Context.FuncArgs:
-                    s = f'{nstr}: {s}' if self._use_type_hints else nstr
-                elif isinstance(self._parent, c_ast.FuncDef):  # self._state & Context.FuncProto:
-                    s = f'{nstr} -> {s}' if self._use_type_hints else nstr
-                else:
-                    # s += ' ' + nstr
-                    if self._type_hint_decl:
-                        s = f'{nstr}: {s}'
-                    else:
-                        s = nstr
-            else:
-                s = self._map_type(s)
-            return s
-        elif typ == c_ast.Decl:
-            return self._generate_decl(n.type)
-        elif typ == c_ast.Typename:
-            return self._generate_type(n.type, parent=n, emit_declname=emit_declname)
-        elif typ == c_ast.IdentifierType:
-            return ' '.join(n.names) + ' '
-        elif typ in (c_ast.ArrayDecl, c_ast.PtrDecl, c_ast.FuncDecl):
-            return self._generate_type(n.type, parent=n, modifiers=modifiers + [n], emit_declname=emit_declname)
-        else:
-            return self.visit(n, parent=parent)
+        # Resolve modifiers.
+        # Wrap in parens to distinguish pointer to array and pointer to
+        # function syntax.
+        for i, modifier in enumerate(modifiers):
+            if isinstance(modifier, c_ast.ArrayDecl):
+                # We don't need to wrap stuff at all, TODO: Revisit
+                # if i != 0 and isinstance(modifiers[i - 1], c_ast.PtrDecl):
+                #     nstr = '(' + nstr + ')'
+                # TODO: Remove, check dim processing
+                # nstr += '['
+                # if modifier.dim_quals:
+                #     nstr += ' '.join(modifier.dim_quals) + ' '
+                # nstr += self.visit(modifier.dim, parent=n) + ']'
+                if render_type:
+                    s = self._list_type(s)
+            elif isinstance(modifier, c_ast.FuncDecl):
+                # We don't need to wrap stuff at all, TODO: Revisit
+                # if i != 0 and isinstance(modifiers[i - 1], c_ast.PtrDecl):
+                #     nstr = '(' + nstr + ')'
+                nstr += '(' + self.visit(modifier.args, parent=parent, flag=Context.FuncArgs) + ')'
+            elif isinstance(modifier, c_ast.PtrDecl):
+                # TODO: We don't support quals (like 'const'), skipped
+                # if modifier.quals:
+                #     nstr = '* %s%s' % (' '.join(modifier.quals), ' ' + nstr if nstr else '')
+                # else:
+                #     nstr = '*' + nstr
+                # There's no real way to determine what's this ptr means, so we can guess
+                if render_type:
+                    s = self._list_type(s)
+        if nstr:
+            # s += ' ' + nstr
+            return f'{nstr}{hint_sep}{self.types_map.get(s, s)}' if hint_sep is not None else nstr
+        return self.types_map.get(s, s)
+
+    def _generate_decl_type(self, n, *, parent, modifiers, emit_declname):
+        return self._generate_decl(n.type)
+
+    def _generate_typename_type(self, n, *, parent, modifiers, emit_declname):
+        return self._generate_type(n.type, parent=n, emit_declname=emit_declname)
+
+    def _generate_identifier_type(self, n, *, parent, modifiers, emit_declname):
+        return ' '.join(n.names) + ' '
+
+    def _generate_modifier_type(self, n, *, parent, modifiers, emit_declname):
+        # The same list is threaded down to the TypeDecl, no copy per nesting level
+        modifiers.append(n)
+        try:
+            return self._generate_type(n.type, parent=n, modifiers=modifiers, emit_declname=emit_declname)
+        finally:
+            modifiers.pop()
 
     def _parenthesize_if(self, n, *, parent, condition):
         """ Visits 'n' and returns its string representation, parenthesized
@@ -881,17 +971,10 @@ class PyGenerator:
     def _is_simple_node(self, n):
         """ Returns True for nodes that are "simple" - i.e. nodes that always
         have higher precedence than operators. """
-        # Check for python related reduced cases
-        if (
-            isinstance(n, c_ast.Cast) or
-            (isinstance(n, c_ast.UnaryOp) and n.op in ('&', '*'))
-        ):
-            return True
-        return isinstance(n, (c_ast.Constant, c_ast.ID, c_ast.ArrayRef,
-                              c_ast.StructRef, c_ast.FuncCall))  # Cast is reduced, so it's simple now
+        node_type = type(n)
+        # Check for python related reduced cases, Cast is reduced, so it's simple now
+        return node_type in SIMPLE_NODE_TYPES or (node_type is c_ast.UnaryOp and n.op in ('&', '*'))
 
     def _is_single_node(self, n):
         # TODO: More cases here + invert the check, there are not so many complex nodes (compound, etc)
-        return isinstance(n, (
-            c_ast.BinaryOp, c_ast.UnaryOp, c_ast.FuncCall, c_ast.Constant, c_ast.ID, c_ast.Cast, c_ast.StructRef
-        ))
+        return type(n) in SINGLE_NODE_TYPES
@@ -1,10 +1,14 @@
+import os
 import re
+import pickle
+import hashlib
 import tempfile
 import subprocess
 
 from pathlib import Path
 from typing import List, Optional
 
+from pycparser import __version__ as pycparser_version
 from pycparser.c_parser import CParser
 from pycparser.c_generator import CGenerator
 
@@ -16,14 +20,10 @@ OUTPUT_PATH = Path('/home/nxpub/dev/nxbindgen/build/')
 
 
 def preprocess(c_path: Path, *, keep_comments: bool = False, cpp_args: Optional[List[str]] = None) -> str:
-    lines = []
     run_line = ['cpp', '-nostdinc', '-E', '-P', *(cpp_args or []), str(c_path)] + (['-CC'] if keep_comments else [])
     print(' '.join(run_line))
-    for line in map(lambda x: x.strip(), subprocess.Popen(
-        run_line, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
-    ).stdout.read().decode('utf-8').splitlines()):
-        lines.append(line)
-    return '\n'.join(lines)
+    # Waits for cpp to exit, diagnostics are ignored as before, indentation doesn't matter for the parser
+    return subprocess.run(run_line, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8').stdout
 
 
 def remove_comments(cdef: str) -> str:
@@ -37,45 +37,51 @@ class PythonConverter:
         imports: Optional[List[str]] = None,
         includes: Optional[List[str]] = None,
         defines: Optional[dict] = None,
+        cache_dir: Optional[Path] = None,
     ) -> None:
         self._ast = None
+        self._cache_dir = cache_dir
         self._imports = imports or []
-        self._defines = defines or {}
-        self._includes = includes or []
+        # Rendered once, every translation unit gets the same blocks
+        self._includes_block = ''.join(f'#include "{include_name}"\n' for include_name in includes or [])
+        self._defines_block = ''.join(
+            f'#define {macro_src} {macro_dst}'.strip() + '\n' for macro_src, macro_dst in (defines or {}).items()
+        )
 
     # Specifically for 3.11 version
-    RE_BEGIN_MARKER = re.compile(r'/\* BEWARE!(\s+.*){3}?\*/', re.MULTILINE)
-    RE_END_MARKER = re.compile(r'#if USE_COMPUTED_GOTOS\s+TARGET_DO_TRACING:', re.MULTILINE)
+    RE_BEGIN_MARKER = re.compile(r'/\* BEWARE![\s\S]*?\*/')
+    RE_END_MARKER = re.compile(r'#if USE_COMPUTED_GOTOS\s+TARGET_DO_TRACING:')
 
     def crop(self, source: str) -> str:
         begin_match = self.RE_BEGIN_MARKER.search(source)
         end_match = self.RE_END_MARKER.search(source)
         return source[begin_match.span()[1]:end_match.span()[0]]
 
+    FIXES_BLOCK = ''.join(f'#define {macro_src} {macro_dst}'.strip() + '\n' for macro_src, macro_dst in {
+        # https://github.com/eliben/pycparser/wiki/FAQ#what-do-i-do-about-__attribute__
+        '__attribute__(x)': '',
+        '__typeof__(x)': '',
+        # https://github.com/eliben/pycparser/issues/430, https://github.com/eliben/pycparser/issues/476
+        '_Atomic(x)': 'x',
+    }.items())
+
     def apply_fixes(self, fp, header_path: Path) -> None:
-        for macro_src, macro_dst in {
-            # https://github.com/eliben/pycparser/wiki/FAQ#what-do-i-do-about-__attribute__
-            '__attribute__(x)': '',
-            '__typeof__(x)': '',
-            # https://github.com/eliben/pycparser/issues/430, https://github.com/eliben/pycparser/issues/476
-            '_Atomic(x)': 'x',
-        }.items():
-            fp.write(f'#define {macro_src} {macro_dst}'.strip() + '\n')
-        for include_name in self._includes:
-            fp.write(f'#include "{include_name}"\n')
-        for macro_src, macro_dst in self._defines.items():
-            fp.write(f'#define {macro_src} {macro_dst}'.strip() + '\n')
+        fp.write(self.FIXES_BLOCK + self._includes_block + self._defines_block)
         with open(header_path) as h_file:
             lines = self.crop(h_file.read()).splitlines()
-            for idx, line in enumerate(lines):
-                clean = line.strip()
-                if not clean:
-                    fp.write('//\n')
-                else:
-                    # https://github.com/eliben/pycparser/issues/484
-                    if clean.endswith(':') and lines[idx + 1].strip() == '}':
-                        line = f'{line};'
-                    fp.write(line + '\n')
+        # Every line is stripped once, the next one is looked up from the same list
+        cleans = [line.strip() for line in lines] + ['']
+        out = []
+        for idx, line in enumerate(lines):
+            clean = cleans[idx]
+            if not clean:
+                out.append('//\n')
+            # https://github.com/eliben/pycparser/issues/484
+            elif clean.endswith(':') and cleans[idx + 1] == '}':
+                out.append(f'{line};\n')
+            else:
+                out.append(line + '\n')
+        fp.write(''.join(out))
         fp.flush()
 
     def load_c(
@@ -90,32 +96,75 @@ class PythonConverter:
                 *map(lambda p: f'-I{p}', includes)
             ])
         # processed = remove_comments(processed)
+        cache_path = None
+        if self._cache_dir is not None:
+            # Parsing is the slow part, same preprocessed source gives the same AST
+            key = hashlib.blake2b(f'{pycparser_version}\n{path}\n{processed}'.encode('utf-8')).hexdigest()
+            cache_path = self._cache_dir / f'ast-{path.stem}-{key}.pkl'
+            if cache_path.exists():
+                try:
+                    with open(cache_path, 'rb') as cache_file:
+                        self._ast = pickle.load(cache_file)
+                    return
+                except Exception:
+                    # Broken or foreign entry, it's parsed again and replaced below
+                    cache_path.unlink(missing_ok=True)
         self._ast = CParser().parse(processed, filename=str(path))
-
-    REPLACERS = {
-        r'(\s{0,})env\.stack\.peek\((.*?)\) = (.*)(\s{0,})': r'\1env.stack.poke(\2, \3)\4'
-    }
+        if cache_path is not None:
+            temp_path = None
+            try:
+                self._cache_dir.mkdir(parents=True, exist_ok=True)
+                # Older entries for this source and leftovers of interrupted runs are never read again
+                for stale_path in self._cache_dir.iterdir():
+                    if stale_path.suffix == '.tmp' or (
+                        stale_path.name.startswith(f'ast-{path.stem}-') and stale_path.suffix == '.pkl'
+                    ):
+                        stale_path.unlink(missing_ok=True)
+                # Written under a temporary name first, an interrupted run never leaves a partial entry
+                with tempfile.NamedTemporaryFile('wb', dir=self._cache_dir, suffix='.tmp', delete=False) as temp_file:
+                    temp_path = Path(temp_file.name)
+                    pickle.dump(self._ast, temp_file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, cache_path)
+            except (RecursionError, OSError):
+                # Too deeply nested to pickle or can't be stored, it's parsed again next time
+                if temp_path is not None:
+                    temp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _rewrite_peek(line: str) -> str:
+        # `env.stack.peek(X) = Y` -> `env.stack.poke(X, Y)`, same as r'env\.stack\.peek\((.*?)\) = (.*)'
+        if (begin := line.find('env.stack.peek(')) < 0:
+            return line
+        if (end := line.find(') = ', begin + 15)) < 0:
+            return line
+        return f'{line[:begin]}env.stack.poke({line[begin + 15:end]}, {line[end + 4:]})'
 
     def _fix_line(self, line: str) -> Optional[str]:
         # if line.strip():
-        for src, dst in self.REPLACERS.items():
-            line = re.sub(src, dst, line)
-        return line
+        return self._rewrite_peek(line)
 
     def render_py(self, path: Path) -> None:
         generator = PyGenerator(keep_empty_declarations=False, type_hint_declarations=False)
         with open(path, 'w') as py_file:
             if self._imports:
-                for imp in self._imports:
-                    py_file.write(imp + '\n')
-                py_file.write('\n\n')
+                py_file.write('\n'.join(self._imports) + '\n\n\n')
             started = False
-            for line in generator.visit(self._ast, parent=None).splitlines():
-                if line.startswith('def op_NOP('):
-                    started = True
-                if started:
+            # Chunks always end with a newline, so lines never span two of them, one write per chunk
+            for chunk in generator.iter_file_ast(self._ast):
+                if not started:
+                    # Everything before op_NOP is dropped, found once instead of checking every line
+                    if chunk.startswith('def op_NOP('):
+                        started = True
+                    elif (start := chunk.find('\ndef op_NOP(')) >= 0:
+                        started, chunk = True, chunk[start + 1:]
+                    else:
+                        continue
+                lines = []
+                for line in chunk.splitlines():
                     if (line := self._fix_line(line)) is not None:
-                        py_file.write(line + '\n')
+                        lines.append(line)
+                if lines:
+                    py_file.write('\n'.join(lines) + '\n')
 
     def render_c(self, path: Path) -> None:
         generator = CGenerator()
@@ -131,6 +180,7 @@ if __name__ == '__main__':
         ],
         includes=config.INCLUDES,
         defines=config.DEFINES,
+        cache_dir=OUTPUT_PATH / '.ast-cache',
     )
     bc.load_c(
         CPYTHON_PATH / 'Python/ceval.c',
@@ -148,5 +198,6 @@ if __name__ == '__main__':
     )
     # bc.render_c(OUTPUT_PATH / 'test_kitchen_sink.c')
     # bc.render_py(OUTPUT_PATH / 'test_kitchen_sink.py')
+    # Rendered in-process, handing the converter to workers would pickle the whole AST for each of them
     bc.render_c(OUTPUT_PATH / 'generated_cases.c.h')
     bc.render_py(OUTPUT_PATH / 'generated_cases.py')
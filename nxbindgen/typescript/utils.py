@@ -1,15 +1,25 @@
 import re
+import functools
 
 __all__ = [
     'to_python',
 ]
 
+RE_UPPER = re.compile('[A-Z]')
+RE_WORD = re.compile('(.)([A-Z][a-z]+)')
+RE_DOUBLE_UNDERSCORE = re.compile('__([A-Z])')
+RE_LOWER_UPPER = re.compile('([a-z0-9])([A-Z])')
 
+
+# Pure and called for the same names over and over across the AST
+@functools.lru_cache(maxsize=4096)
 def to_python(name: str) -> str:
-    # TODO: Compile REs externally
     if name.isupper():
         return name
-    name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    name = re.sub('__([A-Z])', r'_\1', name)
-    name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
+    # Nothing to split without an uppercase letter after the first one
+    if not RE_UPPER.search(name, 1):
+        return name.lower()
+    name = RE_WORD.sub(r'\1_\2', name)
+    name = RE_DOUBLE_UNDERSCORE.sub(r'_\1', name)
+    name = RE_LOWER_UPPER.sub(r'\1_\2', name)
     return name.lower()